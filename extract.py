@@ -1,4 +1,47 @@
+import asyncio
+import concurrent.futures
+
+import aiohttp
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ARCGIS_URL = "https://sigel.aneel.gov.br/arcgis/rest/services/PORTAL/WFS/MapServer/0/query"
+
+# Filtros de validação aplicados já no servidor (mesmos critérios de processing.validate_gdf)
+# e apenas as colunas usadas no .csv final, reduzindo o volume baixado
+SERVER_FILTER_PARAMS = {
+    "where": (
+        "versao='Versão Válida' AND operacao IS NOT NULL AND pot_mw IS NOT NULL "
+        "AND alt_total IS NOT NULL AND alt_torre IS NOT NULL AND diam_rotor IS NOT NULL "
+        "AND eol_versao_id IS NOT NULL AND nome_eol IS NOT NULL AND den_aeg IS NOT NULL"
+    ),
+    "outFields": (
+        "pot_mw,alt_total,alt_torre,diam_rotor,eol_versao_id,nome_eol,den_aeg,operacao,"
+        "proprietario,objectid,uf,ceg,versao,data_atualizacao"
+    ),
+}
+
+# Política de novas tentativas para falhas transitórias do servidor, usada tanto na
+# sessão do requests quanto nas páginas concorrentes do aiohttp
+_RETRY_TOTAL = 5
+_RETRY_BACKOFF_FACTOR = 0.3
+_RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504]
+
+# Sessão compartilhada entre chamadas: mantém a conexão (keep-alive)
+# e refaz automaticamente requisições que falham por instabilidade do servidor
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        max_retries=Retry(
+            total=_RETRY_TOTAL,
+            backoff_factor=_RETRY_BACKOFF_FACTOR,
+            status_forcelist=_RETRY_STATUS_FORCELIST,
+        ),
+    ),
+)
 
 def _default_params(offset: int = 0, limit: int = 2000):
     """
@@ -15,58 +58,143 @@ def _default_params(offset: int = 0, limit: int = 2000):
     }
 
 
-def fetch_page(session: requests.Session, url = str, offset: int = 0, extra_params: dict() = None, limit: int = 2000):
+def _raise_for_arcgis_error(data: dict):
     """
-    Busca uma página do serviço com resultOffset.
-    Retorna o dicionário JSON da resposta do ArcGIS.
+    Erros do ArcGIS vêm dentro do próprio JSON (com HTTP 200).
     """
-    params = _default_params(offset, limit)
+    if "error" in data:
+        raise RuntimeError(f"ArcGIS error: {data['error']}")
+
+
+def fetch_count(session: requests.Session, url: str = ARCGIS_URL, extra_params: dict = None) -> int:
+    """
+    Consulta apenas o total de registros (returnCountOnly) para planejar a paginação.
+    """
+    params = _default_params()
+    # Contagem não usa paginação
+    params.pop("resultOffset")
+    params.pop("resultRecordCount")
 
     if extra_params:
         params.update(extra_params)
 
+    params.update({"returnCountOnly": "true", "returnGeometry": "false", "f": "json"})
+
     resp = session.get(url, params=params, timeout=60)
     resp.raise_for_status()
 
-    data = resp.json()
-    
-    # Erros do ArcGIS vêm dentro do próprio JSON
-    if "error" in data:
-        raise RuntimeError(f"ArcGIS error: {data['error']}")
-        
+    data = orjson.loads(resp.content)
+    _raise_for_arcgis_error(data)
+
+    return data["count"]
+
+
+async def fetch_page_async(session: aiohttp.ClientSession, url: str = ARCGIS_URL, offset: int = 0, extra_params: dict = None, limit: int = 2000):
+    """
+    Busca uma página do serviço com resultOffset e retorna o dicionário JSON da resposta.
+    É assíncrona para disparar várias páginas em paralelo sobre o mesmo pool de conexões (keep-alive).
+    Refaz a requisição (até _RETRY_TOTAL vezes) em 429/5xx e erros de conexão.
+    """
+    params = _default_params(offset, limit)
+    # O ArcGIS só garante paginação estável por resultOffset com ordenação explícita;
+    # sem ela, páginas buscadas em paralelo podem se sobrepor ou deixar buracos
+    params["orderByFields"] = "objectid"
+
+    if extra_params:
+        params.update(extra_params)
+
+    for attempt in range(_RETRY_TOTAL + 1):
+        last_attempt = attempt == _RETRY_TOTAL
+
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                if resp.status not in _RETRY_STATUS_FORCELIST or last_attempt:
+                    resp.raise_for_status()
+                    # orjson decodifica direto dos bytes, bem mais rápido que o json da stdlib
+                    data = orjson.loads(await resp.read())
+                    break
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+
+        # Falha transitória (429/5xx ou conexão): espera com backoff exponencial e tenta de novo
+        await asyncio.sleep(_RETRY_BACKOFF_FACTOR * 2 ** attempt)
+
+    _raise_for_arcgis_error(data)
+
     return data
 
 
-def fetch_all_features(extra_params: dict() = None, verbose: bool = True):
+async def fetch_all_features_async(extra_params: dict = None, verbose: bool = True, concurrency: int = 16):
     """
-    Busca todas as páginas e concatena a lista de 'features' em memória.
-    Usa o indicador 'exceededTransferLimit' para saber se deve continuar paginando.
+    Busca todas as páginas concorrentemente e concatena a lista de 'features' em memória.
+    Primeiro consulta o total de registros e, a partir dele, calcula os offsets de
+    todas as páginas, que são requisitadas de uma só vez (até `concurrency` em paralelo).
+    Por padrão usa SERVER_FILTER_PARAMS; chaves em `extra_params` têm precedência.
     """
-    features = []
-    offset = 0
+    extra_params = {**SERVER_FILTER_PARAMS, **(extra_params or {})}
 
-    ARCGIS_URL = "https://sigel.aneel.gov.br/arcgis/rest/services/PORTAL/WFS/MapServer/0/query"
-    
     # Dica: o serviço normalmente limita ~1000 por requisição. Usaremos esse chunk.
     limit = 1000
 
-    with requests.Session() as s:
-        while True:
-            data = fetch_page(s, url=ARCGIS_URL, offset=offset, extra_params=extra_params, limit = limit)
-            page_features = data.get("features", [])
-            features.extend(page_features)
+    total = await asyncio.to_thread(fetch_count, _SESSION, ARCGIS_URL, extra_params)
+
+    if verbose:
+        print(f"[INFO] Total de registros no serviço: {total}")
+
+    offsets = range(0, total, limit)
+
+    # Lista pré-alocada com o total: cada página escreve na sua fatia, mantendo a
+    # ordem determinística independentemente da ordem em que as respostas chegam
+    features = [None] * total
+    fetched = 0
 
-            if verbose:
-                print(f"[INFO] Página offset={offset} → {len(page_features)} registros (acum: {len(features)})")
+    async def fill_page(session: aiohttp.ClientSession, offset: int):
+        nonlocal fetched
 
-            # Sinal do ArcGIS de que ainda há mais páginas
-            exceeded = data.get("exceededTransferLimit", False)
+        data = await fetch_page_async(session, ARCGIS_URL, offset, extra_params, limit)
+        page_features = data.get("features", [])
 
-            # Heurística adicional: se veio menos que o limit, geralmente acabou
-            if not exceeded or len(page_features) < limit:
-                break
+        # Página incompleta no meio da paginação (ou truncada pelo servidor) deixaria um
+        # buraco no resultado: o maxRecordCount do serviço provavelmente é menor que `limit`
+        expected = min(limit, total - offset)
+        is_last_page = offset + limit >= total
+        if len(page_features) < expected and (not is_last_page or data.get("exceededTransferLimit", False)):
+            raise RuntimeError(
+                f"Página offset={offset} retornou {len(page_features)} de {expected} registros esperados "
+                f"(maxRecordCount do serviço menor que limit={limit}?)"
+            )
 
-            offset += limit
+        features[offset:offset + len(page_features)] = page_features
+        fetched += len(page_features)
+
+        if verbose:
+            print(f"[INFO] Página offset={offset} → {len(page_features)} registros (acum: {fetched})")
+
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[fill_page(session, offset) for offset in offsets])
+
+    # A última página pode vir menor que a contagem (dados alterados entre as consultas)
+    if fetched < total:
+        print(f"[WARNING] Número de registros a menos que a contagem do serviço: {total - fetched}")
+        features = [feature for feature in features if feature is not None]
 
     return features
 
+
+def fetch_all_features(extra_params: dict() = None, verbose: bool = True):
+    """
+    Busca todas as páginas e concatena a lista de 'features' em memória.
+    Ponto de entrada síncrono para fetch_all_features_async.
+    """
+    coro = fetch_all_features_async(extra_params=extra_params, verbose=verbose)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Dentro do Jupyter já existe um event loop rodando: executa o nosso em outra thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
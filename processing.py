@@ -1,7 +1,8 @@
 """
 Data Processing — Casa dos Ventos (PS Analytics)
 Lê o GEOJSON bruto (features do ArcGIS), cria um GeoDataFrame (WGS84),
-extrai latitude/longitude e exporta um .csv para uso no Tableau.
+extrai latitude/longitude, converte para DataFrame (sem geometria) e
+exporta um .csv para uso no Tableau.
 
 Entradas:
 - geojson resultado da API   (gerado no passo 1)
@@ -12,17 +13,43 @@ Saídas:
 
 import json
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 
-def gdf_from_geojson(geojson: dict):
+# Tabela de tradução para trocar quebras de linha por espaço (sem regex)
+_LINE_BREAKS_TABLE = str.maketrans({"\r": " ", "\n": " "})
+
+def _point_xy(feature: dict):
+    """
+    Coordenadas (x, y) do Point de uma feature; (NaN, NaN) se a geometria for nula
+    ou vazia ("coordinates": []).
+    """
+    geometry = feature.get("geometry")
+    coordinates = geometry.get("coordinates") if geometry else None
+
+    if not coordinates or len(coordinates) < 2:
+        return (np.nan, np.nan)
+
+    return coordinates[:2]
+
+def gdf_from_geojson(geojson: dict | list):
     """
-    Converte a resposta da API (GeoJSON ou ESRI JSON) em GeoDataFrame no CRS EPSG:4326.
+    Converte a resposta da API (FeatureCollection ou lista de features GeoJSON)
+    em GeoDataFrame no CRS EPSG:4326.
+    Todas as geometrias são Point já em WGS84 (outSR=4326), então os pontos são
+    construídos de forma vetorizada com shapely.points, sem criar um Point por feature.
     """
-    gdf = gpd.GeoDataFrame.from_features(geojson, crs="EPSG:4326")
-    # garante CRS correto
-    if gdf.crs is None:
-        gdf.set_crs("EPSG:4326", inplace=True)
-    elif gdf.crs.to_string() != "EPSG:4326":
-        gdf = gdf.to_crs("EPSG:4326")
+    features = geojson["features"] if isinstance(geojson, dict) else geojson
+
+    props = pd.DataFrame.from_records([f.get("properties") or {} for f in features])
+
+    # Geometria nula/vazia vira (NaN, NaN) e depois None, para ser removida na validação
+    coords = np.array([_point_xy(f) for f in features], dtype=np.float64).reshape(-1, 2)
+    geometry = shapely.points(coords[:, 0], coords[:, 1])
+    geometry[np.isnan(coords).any(axis=1)] = None
+
+    gdf = gpd.GeoDataFrame(props, geometry=geometry, crs="EPSG:4326")
     return gdf
 
 def lowercase_columns(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
@@ -30,21 +57,44 @@ def lowercase_columns(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     Converte todos os nomes de colunas de um GeoDataFrame para minúsculo.
     Mantém a coluna 'geometry' inalterada.
     """
-    gdf = gdf.copy()
+    # Cópia rasa: não modifica o original sem duplicar os arrays de dados
+    gdf = gdf.copy(deep=False)
     gdf.columns = [col.lower() if col != gdf.geometry.name else col for col in gdf.columns]
     return gdf
 
+def categorize_version(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Converte a coluna 'versao' (baixa cardinalidade, usada no filtro de versão válida)
+    para dtype category, para que a comparação seja feita sobre os códigos inteiros.
+    Os valores não são alterados. Por não ser mais object, ela não passa por
+    deal_with_line_breaks, o que não afeta o .csv: 'versao' é descartada em validate_gdf.
+    """
+    if "versao" in gdf.columns:
+        gdf["versao"] = gdf["versao"].astype("category")
+
+    return gdf
+
 def add_lat_lon(gdf: gpd.GeoDataFrame):
     """
     Cria colunas 'latitude' e 'longitude' a partir da coluna de geometria (Point).
-    Assume CRS WGS84 (EPSG:4326), onde geometry.x = lon e geometry.y = lat.
+    Assume CRS WGS84 (EPSG:4326), onde x = lon e y = lat.
     """
-    # Se for Point: .x (lon), .y (lat)
-    gdf["longitude"] = gdf.geometry.x
-    gdf["latitude"] = gdf.geometry.y
+    # Uma chamada vetorizada no array GEOS inteiro; geometria nula vira NaN
+    geometry = gdf.geometry.to_numpy()
+    gdf["longitude"] = shapely.get_x(geometry)
+    gdf["latitude"] = shapely.get_y(geometry)
     return gdf
 
-def date_to_utc(gdf: gpd.GeoDataFrame):
+def to_dataframe(gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    Descarta a geometria e devolve um DataFrame comum do pandas.
+    Depois de extrair latitude/longitude, nenhum passo seguinte precisa de GeoPandas.
+    Linhas com geometria nula ficam com latitude/longitude NaN (ver add_lat_lon),
+    e são removidas em validate_gdf.
+    """
+    return pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+
+def date_to_utc(gdf: pd.DataFrame):
     """
     Cria coluna com a data de atualização no padrão UTC.
     """
@@ -52,29 +102,54 @@ def date_to_utc(gdf: gpd.GeoDataFrame):
     
     for column in date_cols:
         if column in gdf.columns:
-            gdf[f"{column}_utc"] = gdf[column].astype("datetime64[ms]").dt.tz_localize("UTC")
+            # Epoch em ms -> datetime UTC numa única conversão
+            gdf[f"{column}_utc"] = pd.to_datetime(gdf[column], unit="ms", utc=True)
             gdf.drop(columns=[column], inplace=True)
 
     return gdf
     
-def deal_with_line_breaks(gdf: gpd.GeoDataFrame):
+def _object_cols(gdf: pd.DataFrame) -> list:
+    """
+    Lista das colunas de texto (dtype object), base dos tratamentos de strings.
+    """
+    return gdf.select_dtypes(include="object").columns.tolist()
+
+def deal_with_line_breaks(gdf: pd.DataFrame):
     """
     Lida com quebras de linha existentes nos dados para não dar erro na hora de gerar o aquivo csv.
     """
-    for col in gdf.select_dtypes(include="object").columns:
-        gdf[col] = gdf[col].str.replace(r'[\r\n]+', ' ', regex=True)
+    obj_cols = _object_cols(gdf)
+
+    if obj_cols:
+        gdf[obj_cols] = gdf[obj_cols].apply(lambda series: series.str.translate(_LINE_BREAKS_TABLE))
 
     return gdf
 
-def remove_outliers_iqr(gdf: gpd.GeoDataFrame,columns: list,k: float = 1.5, treat_na_as_outlier: bool = True):
+def _iqr_inliers(arr: np.ndarray, k: float, treat_na_as_outlier: bool) -> np.ndarray:
+    """
+    Máscara (n, m) de valores dentro de [Q1 - k*IQR, Q3 + k*IQR] para cada coluna de `arr`.
+    """
+    q1, q3 = np.nanpercentile(arr, [25, 75], axis=0)
+    iqr = q3 - q1
+
+    # Comparações com NaN resultam em False
+    inliers = (arr >= q1 - k * iqr) & (arr <= q3 + k * iqr)
+
+    if not treat_na_as_outlier:
+        # NaN não contam como outlier -> NaN tratados como True (mantém linha)
+        inliers |= np.isnan(arr)
+
+    return inliers
+
+def remove_outliers_iqr(gdf: pd.DataFrame,columns: list,k: float = 1.5, treat_na_as_outlier: bool = True):
     """
-    Remove linhas de um GeoDataFrame que contenham outliers (método Boxplot/IQR)
+    Remove linhas de um DataFrame que contenham outliers (método Boxplot/IQR)
     em qualquer uma das colunas especificadas.
 
     Parâmetros
     ----------
-    gdf : gpd.GeoDataFrame
-        GeoDataFrame de entrada.
+    gdf : pd.DataFrame
+        DataFrame de entrada.
     columns : list
         Lista com os nomes das colunas numéricas para aplicar o método IQR.
     k : float, opcional (default=1.5)
@@ -85,8 +160,8 @@ def remove_outliers_iqr(gdf: gpd.GeoDataFrame,columns: list,k: float = 1.5, trea
 
     Retorno
     -------
-    gpd.GeoDataFrame
-        Novo GeoDataFrame sem as linhas consideradas outliers.
+    pd.DataFrame
+        Novo DataFrame sem as linhas consideradas outliers.
 
     Observações
     -----------
@@ -95,51 +170,38 @@ def remove_outliers_iqr(gdf: gpd.GeoDataFrame,columns: list,k: float = 1.5, trea
     - Linhas são removidas se QUALQUER coluna indicada tiver outlier.
     """
 
-    # Cria uma cópia para não modificar o original
-    gdf_filtered = gdf.copy()
-    data_count = len(gdf_filtered)
-    
-    # Começa mantendo todas as linhas
-    keep_mask = gdf_filtered.index == gdf_filtered.index
-
     for col in columns:
-        if col not in gdf_filtered.columns:
-            raise KeyError(f"Column '{col}' not found in GeoDataFrame.")
+        if col not in gdf.columns:
+            raise KeyError(f"Column '{col}' not found in DataFrame.")
 
-        series = gdf_filtered[col]
-
-        # Garante que é numérica (sem importar pandas explicitamente)
-        if not hasattr(series.dtype, "kind") or series.dtype.kind not in ("i", "u", "f"):
+        # Garante que é numérica
+        if not hasattr(gdf[col].dtype, "kind") or gdf[col].dtype.kind not in ("i", "u", "f"):
             raise TypeError(f"Column '{col}' is not numeric. Convert before applying IQR.")
 
-        q1 = series.quantile(0.25)
-        q3 = series.quantile(0.75)
-        iqr = q3 - q1
+    # Sem linhas não há quartis (np.nanpercentile devolveria um único NaN)
+    if len(gdf) == 0:
+        return gdf.reset_index(drop=True)
 
-        lower_limit = q1 - k * iqr
-        upper_limit = q3 + k * iqr
+    # Todas as máscaras são calculadas de uma vez sobre o DataFrame original
+    # e o filtro é aplicado uma única vez no final
+    vals = gdf[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    inliers = _iqr_inliers(vals, k, treat_na_as_outlier)
 
-        col_inlier = (series >= lower_limit) & (series <= upper_limit)
+    keep = np.ones(len(gdf), dtype=bool)
 
-        if treat_na_as_outlier:
-            # NaN contam como outlier -> mantem apenas True
-            col_mask = col_inlier.fillna(False)
-        else:
-            # NaN não contam como outlier -> NaN tratados como True (mantém linha)
-            col_mask = col_inlier.fillna(True)
+    for j, col in enumerate(columns):
+        col_mask = inliers[:, j]
 
-        # Mantém apenas linhas que não são outlier nesta coluna
-        keep_mask = keep_mask & col_mask
+        removed = (keep & ~col_mask).sum()
+        if removed > 0:
+            print(f"[INFO] Detecção e remoção de {removed} outlier(s) na coluna {col}")
 
-        gdf_filtered = gdf_filtered[keep_mask].reset_index(drop=True)
-        
-        if len(gdf_filtered) < data_count:
-                print(f"[INFO] Detecção e remoção de {data_count - len(gdf_filtered)} outlier(s) na coluna {col}")
-                data_count = len(gdf_filtered)
+        # Mantém apenas linhas que não são outlier nesta coluna
+        keep &= col_mask
 
-    return gdf_filtered
+    return gdf.loc[keep].reset_index(drop=True)
 
-def validate_gdf(gdf: gpd.GeoDataFrame):
+def validate_gdf(gdf: pd.DataFrame):
 
     """
     Aplica validações básicas:
@@ -156,43 +218,52 @@ def validate_gdf(gdf: gpd.GeoDataFrame):
     initial_count = len(gdf)
     print(f"[INFO] Número de linhas dos dados crus: {initial_count}")
     
+    # Os filtros 1) e 2) compõem uma única máscara booleana, aplicada uma só vez
+    # no final (evita copiar o DataFrame a cada filtro)
+
     # 1) Geometrias válidas
-    gdf = gdf[gdf.geometry.notna()].copy()
-    gdf = gdf[gdf.geometry.is_valid]
+    # Como todas as geometrias são Point, basta checar as coordenadas (finitas e dentro
+    # dos limites WGS84), sem o GEOSisValid por geometria. Geometria nula já virou NaN.
+    lon = gdf["longitude"].to_numpy(dtype=np.float64)
+    lat = gdf["latitude"].to_numpy(dtype=np.float64)
+    mask = np.isfinite(lon) & np.isfinite(lat) & (np.abs(lon) <= 180) & (np.abs(lat) <= 90)
 
-    valid_geometry_dealt_count = len(gdf)
+    valid_geometry_dealt_count = mask.sum()
     print(f"[INFO] Número de linhas com geometria válida: {valid_geometry_dealt_count}")
 
     # 2) Filtros nas colunas
 
     # 2.1) Somente versão válida
     
-    gdf = gdf[gdf["versao"] == "Versão Válida"]
+    mask &= (gdf["versao"] == "Versão Válida").values
 
-    version_dealt_count = len(gdf)
+    version_dealt_count = mask.sum()
     print(f"[INFO] Número de linhas com versão válida: {version_dealt_count}")
 
     # 2.2) Aerogeradores em operação
 
-    gdf["operacao"] = gdf["operacao"].replace([1, "1"], "Sim") # foi considerado 1 == sim
-
-    missing_operation_info = gdf["operacao"].isnull().sum()
+    operation_notna = gdf["operacao"].notna().values
+    missing_operation_info = (mask & ~operation_notna).sum()
 
     if missing_operation_info > 0: 
         print(f"[WARNING] Número de linhas com informação de operação nula excluídas dos dados: {missing_operation_info}")
 
-    gdf = gdf.dropna(subset=["operacao"])    
-    operation_dealt_count = len(gdf)
+    mask &= operation_notna
+    operation_dealt_count = mask.sum()
     print(f"[INFO] Número de linhas após exclusão de dados sem informação de operação: {operation_dealt_count}")
 
     # 2.3) Excluir dados com nulo em determinada coluna
 
     drop_na_columns = ["pot_mw", "alt_total", "alt_torre", "diam_rotor", "eol_versao_id", "nome_eol", "den_aeg"]
-    gdf = gdf.dropna(subset=drop_na_columns)
+    mask &= gdf[drop_na_columns].notna().all(axis=1).values
 
-    na_values_dealt_count = len(gdf)
+    na_values_dealt_count = mask.sum()
 
     print(f"[INFO] Número de linhas removendo linhas com campos vazios nos dados: {na_values_dealt_count}")
+
+    gdf = gdf.loc[mask].reset_index(drop=True)
+
+    gdf["operacao"] = gdf["operacao"].replace([1, "1"], "Sim") # foi considerado 1 == sim
     
     # 3) Detecção de outlier em colunas
     
@@ -207,7 +278,8 @@ def validate_gdf(gdf: gpd.GeoDataFrame):
 
     # 5) Dropar colunas que não serão utilizadas 
     
-    drop_columns = ["geometry", "origem", "x", "y", "datum_emp", "fuso_ag", "versao"]
-    gdf.drop(columns=drop_columns, inplace=True)
+    drop_columns = ["origem", "x", "y", "datum_emp", "fuso_ag", "versao"]
+    # Podem já não existir quando a extração pede só as colunas úteis (outFields)
+    gdf.drop(columns=drop_columns, inplace=True, errors="ignore")
     
     return gdf